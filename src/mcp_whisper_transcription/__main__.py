@@ -11,6 +11,14 @@ logger = logging.getLogger(__name__)
 
 def main():
     """Entry point for the command line script."""
+    try:
+        # Use uvloop's faster event loop when available
+        import uvloop  # type: ignore
+
+        uvloop.install()
+    except ImportError:
+        pass
+
     try:
         logger.info("Starting MCP Whisper Transcription Server...")
         # FastMCP handles its own event loop internally
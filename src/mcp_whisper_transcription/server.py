@@ -1,16 +1,25 @@
 """Whisper MCP server core code."""
 
 import asyncio
-import base64
+import hashlib
+import mmap
 import os
 import re
 import time
+import wave
 from enum import Enum
-from functools import lru_cache
+from functools import cache, lru_cache
 from pathlib import Path
 from typing import Any, Dict, List, Literal, Optional
 
+import aiofiles
+import av  # type: ignore
+import httpx
+import orjson
+import pybase64  # type: ignore
 from mcp.server import FastMCP
+from mutagen.flac import FLAC  # type: ignore
+from mutagen.mp3 import MP3  # type: ignore
 from openai import AsyncOpenAI
 from openai.types import AudioModel, AudioResponseFormat
 from openai.types.audio.speech_model import SpeechModel
@@ -18,6 +27,11 @@ from openai.types.chat import ChatCompletionContentPartParam, ChatCompletionMess
 from pydantic import BaseModel, Field
 from pydub import AudioSegment  # type: ignore
 
+try:
+    import blake3  # type: ignore
+except ImportError:
+    blake3 = None  # optional; _content_digest falls back to blake2b
+
 # Type definitions for transcription
 SupportedChatWithAudioFormat = Literal["mp3", "wav"]
 AudioChatModel = Literal[
@@ -37,6 +51,16 @@ TRANSCRIBE_AUDIO_FORMATS = {
     ".ogg",  # Added OGG support
 }
 
+CHAT_WITH_AUDIO_FORMATS = frozenset({".mp3", ".wav"})
+
+# Models reported by get_audio_file_support, frozen once at import
+_TRANSCRIPTION_MODELS: tuple[AudioModel, ...] = ("whisper-1", "gpt-4o-transcribe", "gpt-4o-mini-transcribe")
+_CHAT_MODELS: tuple[AudioChatModel, ...] = (
+    "gpt-4o-audio-preview-2024-10-01",
+    "gpt-4o-audio-preview-2024-12-17",
+    "gpt-4o-mini-audio-preview-2024-12-17",
+)
+
 # Enhancement prompts
 ENHANCEMENT_PROMPTS: dict[EnhancementType, str] = {
     "detailed": "The following is a detailed transcript that includes all verbal and non-verbal elements. "
@@ -147,15 +171,6 @@ class TranscribeWithEnhancementInputParams(TranscribeAudioInputParamsBase):
         default="detailed", description="The enhancement type to apply to the transcription"
     )
 
-    def to_transcribe_audio_input_params(self) -> TranscribeAudioInputParams:
-        """Transfer audio with LLM using custom prompt."""
-        return TranscribeAudioInputParams(
-            input_file_path=self.input_file_path,
-            prompt=ENHANCEMENT_PROMPTS[self.enhancement_type],
-            timestamp_granularities=self.timestamp_granularities,
-            response_format=self.response_format,
-        )
-
 
 class CreateClaudecastInputParams(BaseModel):
     """Params for text-to-speech using OpenAI's API."""
@@ -197,18 +212,103 @@ class FilePathSupportParams(BaseModel):
     )
 
 
+@cache
 def check_and_get_audio_path() -> Path:
-    """Check if the audio path environment variable is set and exists."""
+    """Check if the audio path environment variable is set and exists.
+
+    Cached for the lifetime of the server; AUDIO_FILES_PATH is fixed at
+    startup, so the env lookup and path resolution run only once.
+    """
     audio_path_str = os.getenv("AUDIO_FILES_PATH")
     if not audio_path_str:
         raise ValueError("AUDIO_FILES_PATH environment variable not set")
 
-    audio_path = Path(audio_path_str).resolve()
+    # abspath avoids resolve()'s readlink walk; symlinks don't need
+    # resolution here, only an absolute base path
+    audio_path = Path(os.path.abspath(audio_path_str))
     if not audio_path.exists():
         raise ValueError(f"Audio path does not exist: {audio_path}")
     return audio_path
 
 
+def _content_digest(file_path: Path) -> bytes:
+    """Hash a file's contents for use as a cache key.
+
+    Only used when AUDIO_CACHE_CONTENT_KEYS is set, for filesystems where
+    the cheaper (path, mtime, size) key is unreliable, e.g. network
+    mounts with coarse or untrustworthy mtimes. Uses blake3's SIMD
+    multithreaded hasher when installed, stdlib blake2b otherwise; the
+    file is mmap'd so no copy is made.
+    """
+
+    def _digest(data) -> bytes:
+        if blake3 is not None:
+            return blake3.blake3(data, max_threads=blake3.blake3.AUTO).digest()
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:  # mmap rejects empty files
+            return _digest(b"")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            return _digest(view)
+
+
+# Key the duration cache on a content hash instead of mtime; opt-in for
+# filesystems where mtime can't be trusted (e.g. some network mounts)
+_CACHE_CONTENT_KEYS = os.getenv("AUDIO_CACHE_CONTENT_KEYS", "").lower() in {"1", "true", "yes"}
+
+
+@lru_cache(maxsize=512)
+def _probe_duration(file_path: str, cache_token: Any, size_bytes: int) -> Optional[float]:
+    """Probe audio duration in seconds, or None if it cannot be determined.
+
+    cache_token is st_mtime_ns, or a content digest when
+    AUDIO_CACHE_CONTENT_KEYS is set; either way repeat queries for an
+    unchanged file skip the probe and edits invalidate the key naturally.
+    """
+    # Common formats expose duration in their headers; read it directly
+    # instead of opening the container
+    ext = os.path.splitext(file_path)[1].lower()
+    try:
+        if ext == ".wav":
+            with wave.open(file_path, "rb") as wav_file:
+                return wav_file.getnframes() / wav_file.getframerate()
+        if ext == ".mp3":
+            return float(MP3(file_path).info.length)
+        if ext == ".flac":
+            return float(FLAC(file_path).info.length)
+    except Exception:
+        # Malformed header; fall through to the container probe
+        pass
+
+    try:
+        with av.open(file_path) as container:
+            stream = container.streams.audio[0]
+            if stream.duration is not None:
+                return float(stream.duration * stream.time_base)
+            if container.duration is not None:
+                return container.duration / av.time_base
+    except Exception:
+        # Fall back to pydub's full decode if the metadata probe fails
+        try:
+            audio = AudioSegment.from_file(file_path)
+            return len(audio) / 1000.0  # Convert milliseconds to seconds
+        except Exception:
+            # If pydub also fails, we'll just leave duration as None
+            pass
+    return None
+
+
+async def _cached_duration(file_path: Path, stat: os.stat_result) -> Optional[float]:
+    """Probe audio duration through the cache, off the event loop."""
+
+    def probe() -> Optional[float]:
+        cache_token: Any = _content_digest(file_path) if _CACHE_CONTENT_KEYS else stat.st_mtime_ns
+        return _probe_duration(str(file_path), cache_token, stat.st_size)
+
+    return await asyncio.to_thread(probe)
+
+
 async def get_audio_file_support(file_path: Path) -> FilePathSupportParams:
     """Determine audio transcription file format support and metadata.
 
@@ -217,28 +317,18 @@ async def get_audio_file_support(file_path: Path) -> FilePathSupportParams:
     file_ext = file_path.suffix.lower()
 
     transcription_support: list[AudioModel] | None = (
-        ["whisper-1", "gpt-4o-transcribe", "gpt-4o-mini-transcribe"] if file_ext in TRANSCRIBE_AUDIO_FORMATS else None
+        list(_TRANSCRIPTION_MODELS) if file_ext in TRANSCRIBE_AUDIO_FORMATS else None
     )
 
-    chat_support: Optional[List[str]] = (
-        ["gpt-4o-audio-preview-2024-10-01", "gpt-4o-audio-preview-2024-12-17", "gpt-4o-mini-audio-preview-2024-12-17"]
-        if file_ext in [".mp3", ".wav"]
-        else None
-    )
+    chat_support: Optional[List[str]] = list(_CHAT_MODELS) if file_ext in CHAT_WITH_AUDIO_FORMATS else None
 
     # Get file metadata
     stat = file_path.stat()
     modified_time = stat.st_mtime
     size_bytes = stat.st_size
 
-    # Try to get duration using pydub
-    duration_seconds = None
-    try:
-        audio = AudioSegment.from_file(str(file_path))
-        duration_seconds = len(audio) / 1000.0  # Convert milliseconds to seconds
-    except Exception:
-        # If pydub fails, we'll just leave duration as None
-        pass
+    # Try to get duration from container metadata (cached, off the event loop)
+    duration_seconds = await _cached_duration(file_path, stat)
 
     return FilePathSupportParams(
         file_path=file_path,
@@ -251,69 +341,181 @@ async def get_audio_file_support(file_path: Path) -> FilePathSupportParams:
     )
 
 
+_openai_client: Optional[AsyncOpenAI] = None
+
+
+def _get_openai_client() -> AsyncOpenAI:
+    """Return the shared AsyncOpenAI client, creating it on first use.
+
+    Reusing one client keeps httpx's connection pool warm across tool
+    calls, so repeat requests skip the TCP/TLS handshake.
+    """
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(max_retries=2, timeout=httpx.Timeout(300.0, connect=10.0))
+    return _openai_client
+
+
+# Cap concurrent ffmpeg runs at the core count so burst traffic queues
+# instead of oversubscribing the CPU
+_FFMPEG_SEMAPHORE = asyncio.Semaphore(os.cpu_count() or 4)
+
+# Multiple of 3 bytes, so each chunk encodes to base64 without padding
+_BASE64_CHUNK_SIZE = 57 * 1024
+
+
+def _encode_audio_base64(file_path: Path) -> str:
+    """Read and base64-encode a file chunk by chunk; run via asyncio.to_thread.
+
+    Encoding in chunks avoids ever holding the raw bytes and the encoded
+    copy in memory at the same time, and pybase64 uses a SIMD encoder.
+    """
+    encoded = bytearray()
+    with open(file_path, "rb") as audio_file:
+        while chunk := audio_file.read(_BASE64_CHUNK_SIZE):
+            encoded += pybase64.b64encode(chunk)
+    return encoded.decode("ascii")
+
+
+def _do_convert(input_path: Path, output_path: Path, target_format: str) -> None:
+    """Blocking pydub convert; run via asyncio.to_thread."""
+    audio = AudioSegment.from_file(str(input_path))
+    audio.export(str(output_path), format=target_format)
+
+
+def _dump_transcript_json(transcript: Any) -> str:
+    """Serialize a transcript model to indented JSON via orjson."""
+    return orjson.dumps(transcript.model_dump(), option=orjson.OPT_INDENT_2).decode()
+
+
+def _transcript_text(transcript: Any) -> str:
+    """Return the transcript body whether the SDK gave a str or a model."""
+    return transcript if isinstance(transcript, str) else transcript.text
+
+
+# Maps response_format to a formatter for the API's return value;
+# the SDK hands back plain strings for text, srt and vtt
+_TRANSCRIPT_FORMATTERS: Dict[str, Any] = {
+    "text": _transcript_text,
+    "json": _dump_transcript_json,
+    "verbose_json": _dump_transcript_json,
+    "srt": str,
+    "vtt": str,
+}
+
+
+async def _ffmpeg_compress(input_path: Path, output_path: Path, bitrate_kbps: int) -> None:
+    """Re-encode audio to mp3 at the given bitrate with a one-shot ffmpeg run.
+
+    ffmpeg streams decode into encode internally, so unlike the pydub
+    round-trip no PCM buffer is ever materialized on the Python side.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg",
+        "-y",
+        "-i",
+        str(input_path),
+        "-vn",
+        "-c:a",
+        "libmp3lame",
+        "-b:a",
+        f"{bitrate_kbps}k",
+        "-f",
+        "mp3",
+        str(output_path),
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise ValueError(f"ffmpeg exited with code {proc.returncode}: {stderr.decode(errors='replace').strip()}")
+
+
 # Initialize FastMCP server
 app = FastMCP("Whisper Transcription")
 
 
-@app.tool()
-async def transcribe_audio(params: TranscribeAudioInputParams) -> str:
-    """Transcribe audio file using OpenAI Whisper API."""
-    client = AsyncOpenAI()
+async def _transcribe(
+    input_file_path: Path,
+    response_format: AudioResponseFormat,
+    prompt: str | None,
+    timestamp_granularities: list[Literal["word", "segment"]] | None,
+) -> str:
+    """Shared transcription path for the transcribe_* tools.
+
+    Takes plain arguments so callers with already-validated params don't
+    pay a second Pydantic validation pass.
+    """
+    client = _get_openai_client()
 
     # Check if file exists
-    if not params.input_file_path.exists():
-        raise ValueError(f"Audio file not found: {params.input_file_path}")
+    if not input_file_path.exists():
+        raise ValueError(f"Audio file not found: {input_file_path}")
 
     # Check file format support
-    file_support = await get_audio_file_support(params.input_file_path)
+    file_support = await get_audio_file_support(input_file_path)
     if not file_support.transcription_support:
         raise ValueError(f"File format {file_support.format} is not supported for transcription")
 
     try:
-        with open(params.input_file_path, "rb") as audio_file:
+        # Pass an open handle with filename and content type so httpx
+        # streams the multipart body from disk in chunks instead of
+        # buffering the whole file in memory first
+        content_type = f"audio/{input_file_path.suffix.lstrip('.')}"
+        with open(input_file_path, "rb") as audio_file:
             transcript = await client.audio.transcriptions.create(
                 model="whisper-1",
-                file=audio_file,
-                response_format=params.response_format,
-                prompt=params.prompt,
-                timestamp_granularities=params.timestamp_granularities,
+                file=(input_file_path.name, audio_file, content_type),
+                response_format=response_format,
+                prompt=prompt,
+                timestamp_granularities=timestamp_granularities,
             )
 
-        if params.response_format == "text":
-            return transcript.text
-        else:
-            return transcript.model_dump_json(indent=2)
+        # Formats this table doesn't know about get the JSON dump, the
+        # same behavior the old else-branch gave every non-text format
+        return _TRANSCRIPT_FORMATTERS.get(response_format, _dump_transcript_json)(transcript)
 
     except Exception as e:
         raise ValueError(f"Transcription failed: {str(e)}")
 
 
+@app.tool()
+async def transcribe_audio(params: TranscribeAudioInputParams) -> str:
+    """Transcribe audio file using OpenAI Whisper API."""
+    return await _transcribe(
+        params.input_file_path, params.response_format, params.prompt, params.timestamp_granularities
+    )
+
+
 @app.tool()
 async def transcribe_with_enhancement(params: TranscribeWithEnhancementInputParams) -> str:
     """Transcribe audio with enhancement using predefined prompts."""
-    transcribe_params = params.to_transcribe_audio_input_params()
-    return await transcribe_audio(transcribe_params)
+    return await _transcribe(
+        params.input_file_path,
+        params.response_format,
+        ENHANCEMENT_PROMPTS[params.enhancement_type],
+        params.timestamp_granularities,
+    )
 
 
 @app.tool()
 async def chat_with_audio(params: ChatWithAudioInputParams) -> str:
     """Transcribe and analyze audio using OpenAI's audio-capable models."""
-    client = AsyncOpenAI()
+    client = _get_openai_client()
 
     # Check if file exists
     if not params.input_file_path.exists():
         raise ValueError(f"Audio file not found: {params.input_file_path}")
 
-    # Check file format support
-    file_support = await get_audio_file_support(params.input_file_path)
-    if not file_support.chat_support:
-        raise ValueError(f"File format {file_support.format} is not supported for audio chat")
+    # Chat support depends only on the extension, so a full metadata
+    # probe of the file is unnecessary here
+    file_ext = params.input_file_path.suffix.lower()
+    if file_ext not in CHAT_WITH_AUDIO_FORMATS:
+        raise ValueError(f"File format {file_ext[1:]} is not supported for audio chat")
 
     try:
-        # Read and encode audio file
-        with open(params.input_file_path, "rb") as audio_file:
-            audio_data = audio_file.read()
-            audio_base64 = base64.b64encode(audio_data).decode("utf-8")
+        # Read and encode audio file on a worker thread
+        audio_base64 = await asyncio.to_thread(_encode_audio_base64, params.input_file_path)
 
         # Prepare messages
         messages: List[ChatCompletionMessageParam] = []
@@ -323,7 +525,7 @@ async def chat_with_audio(params: ChatWithAudioInputParams) -> str:
 
         # User message with audio
         user_content: List[ChatCompletionContentPartParam] = [
-            {"type": "input_audio", "input_audio": {"data": audio_base64, "format": file_support.format}}
+            {"type": "input_audio", "input_audio": {"data": audio_base64, "format": file_ext[1:]}}
         ]
 
         if params.user_prompt:
@@ -349,17 +551,15 @@ async def convert_audio(params: ConvertAudioInputParams) -> str:
         raise ValueError(f"Audio file not found: {params.input_file_path}")
 
     try:
-        # Load audio file
-        audio = AudioSegment.from_file(str(params.input_file_path))
-
         # Determine output path
         if params.output_file_path:
             output_path = params.output_file_path
         else:
             output_path = params.input_file_path.with_suffix(f".{params.target_format}")
 
-        # Export in target format
-        audio.export(str(output_path), format=params.target_format)
+        # Decode and re-encode on a worker thread so the event loop stays free
+        async with _FFMPEG_SEMAPHORE:
+            await asyncio.to_thread(_do_convert, params.input_file_path, output_path, params.target_format)
 
         return f"Audio converted successfully to {output_path}"
 
@@ -380,9 +580,6 @@ async def compress_audio(params: CompressAudioInputParams) -> str:
         if current_size_mb <= params.max_mb:
             return f"File is already under {params.max_mb}MB ({current_size_mb:.2f}MB). No compression needed."
 
-        # Load audio file
-        audio = AudioSegment.from_file(str(params.input_file_path))
-
         # Determine output path
         if params.output_file_path:
             output_path = params.output_file_path
@@ -391,16 +588,18 @@ async def compress_audio(params: CompressAudioInputParams) -> str:
                 f"{params.input_file_path.stem}_compressed{params.input_file_path.suffix}"
             )
 
-        # Calculate compression ratio needed
-        target_size_bytes = params.max_mb * 1024 * 1024
-        current_size_bytes = params.input_file_path.stat().st_size
-        compression_ratio = target_size_bytes / current_size_bytes
-
-        # Reduce bitrate to achieve target size
-        bitrate = f"{int(128 * compression_ratio)}k"
+        # Pick the bitrate that fits max_mb into the file's duration;
+        # fall back to scaling 128k by the size ratio if duration is unknown
+        stat = params.input_file_path.stat()
+        duration_seconds = await _cached_duration(params.input_file_path, stat)
+        if duration_seconds:
+            bitrate_kbps = int(params.max_mb * 8192 / duration_seconds)
+        else:
+            bitrate_kbps = int(128 * params.max_mb / current_size_mb)
+        bitrate_kbps = max(8, bitrate_kbps)
 
-        # Export compressed audio
-        audio.export(str(output_path), format="mp3", bitrate=bitrate)
+        async with _FFMPEG_SEMAPHORE:
+            await _ffmpeg_compress(params.input_file_path, output_path, bitrate_kbps)
 
         new_size_mb = output_path.stat().st_size / (1024 * 1024)
 
@@ -434,7 +633,7 @@ async def get_file_support(params: FilePathSupportParams) -> str:
 @app.tool()
 async def create_speech(params: CreateClaudecastInputParams) -> str:
     """Convert text to speech using OpenAI's TTS API."""
-    client = AsyncOpenAI()
+    client = _get_openai_client()
 
     try:
         # Determine output path
@@ -448,9 +647,9 @@ async def create_speech(params: CreateClaudecastInputParams) -> str:
             model=params.model, voice=params.voice, input=params.text_prompt, speed=params.speed
         )
 
-        # Save audio file
-        with open(output_path, "wb") as f:
-            f.write(response.content)
+        # Save audio file without blocking the event loop
+        async with aiofiles.open(output_path, "wb") as f:
+            await f.write(response.content)
 
         return f"Speech generated successfully and saved to {output_path}"
 